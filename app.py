@@ -1,128 +1,213 @@
 from fastapi import FastAPI, WebSocket
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 import uvicorn
+import asyncio
+from bisect import bisect_right
 import cv2
-import numpy as np
-import base64
 import json
-from io import BytesIO
-from PIL import Image
+import logging
+import numpy as np
+import msgpack
 import os
+import queue
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+@asynccontextmanager
+async def lifespan(app):
+    # 첫 클라이언트가 그래프 초기화와 JIT 컴파일 비용을 떠안지 않도록 서버 시작 시 미리 실행
+    started = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(frame_executor, warm_up_models)
+    print(f"🔥 모델 예열 완료 ({(time.perf_counter() - started) * 1000:.0f}ms)")
+    yield
+
+app = FastAPI(title="성형외과용 미세표정 분석 시스템 - Cloud Edition", lifespan=lifespan)
+logger = logging.getLogger(__name__)
 
-app = FastAPI(title="성형외과용 미세표정 분석 시스템 - Cloud Edition")
+# FaceMesh 그래프는 동시 호출을 지원하지 않으므로 스레드 수만큼 인스턴스를 만들어 빌려 씀
+# (프레임 처리 전체가 이 스레드 풀에서 실행되어 이벤트 루프는 소켓 I/O만 담당)
+# 가장 최근에 반납된 인스턴스를 먼저 빌려주도록 LIFO로 관리해, 연결이 적을 때
+# 연속 프레임이 같은 FaceMesh로 가서 프레임 간 추적(static_image_mode=False)이 유지됨
+FACE_MESH_POOL_SIZE = int(os.environ.get("FACE_MESH_POOL_SIZE", min(4, os.cpu_count() or 1)))
+face_mesh_pool = queue.LifoQueue()
+frame_executor = ThreadPoolExecutor(max_workers=FACE_MESH_POOL_SIZE)
 
 # 클라우드 환경에서는 MediaPipe 사용 (dlib보다 가볍고 안정적)
 try:
     import mediapipe as mp
     mp_face_mesh = mp.solutions.face_mesh
-    face_mesh = mp_face_mesh.FaceMesh(
-        static_image_mode=False,
-        max_num_faces=1,
-        refine_landmarks=True,
-        min_detection_confidence=0.5,
-        min_tracking_confidence=0.5
-    )
+    for _ in range(FACE_MESH_POOL_SIZE):
+        face_mesh_pool.put(mp_face_mesh.FaceMesh(
+            static_image_mode=False,
+            max_num_faces=1,
+            # 분석에 쓰는 랜드마크는 모두 기본 468개 안에 있으므로 홍채 정밀화 그래프는 생략
+            refine_landmarks=False,
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5
+        ))
     USE_MEDIAPIPE = True
     print("✅ MediaPipe 로드 성공 - 클라우드 최적화 모드")
 except ImportError:
     USE_MEDIAPIPE = False
     print("❌ MediaPipe 없음 - 기본 모드로 실행")
 
-# 전역 변수
-captured_images = {}
-last_frame_data = {"frame": None, "landmarks": None}
+# JPEG 인코딩/디코딩은 libjpeg-turbo 직접 바인딩(simplejpeg) 우선 사용
+try:
+    import simplejpeg
+    USE_SIMPLEJPEG = True
+except ImportError:
+    USE_SIMPLEJPEG = False
+    print("ℹ️ simplejpeg 없음 - OpenCV JPEG 코덱 사용")
 
-def analyze_face_asymmetry_mediapipe(landmarks, image_width, image_height):
-    """MediaPipe 랜드마크를 사용한 비대칭 분석"""
-    if not landmarks or len(landmarks) < 468:
-        return None
-    
-    # MediaPipe 주요 랜드마크 인덱스
-    LEFT_EYE_OUTER = 33
-    RIGHT_EYE_OUTER = 263
-    NOSE_TIP = 1
-    CHIN = 18
-    LEFT_MOUTH = 61
-    RIGHT_MOUTH = 291
-    
-    # 픽셀 좌표로 변환
-    def to_pixel(landmark):
-        return [int(landmark.x * image_width), int(landmark.y * image_height)]
-    
-    left_eye = to_pixel(landmarks[LEFT_EYE_OUTER])
-    right_eye = to_pixel(landmarks[RIGHT_EYE_OUTER])
-    nose_tip = to_pixel(landmarks[NOSE_TIP])
-    chin = to_pixel(landmarks[CHIN])
-    left_mouth = to_pixel(landmarks[LEFT_MOUTH])
-    right_mouth = to_pixel(landmarks[RIGHT_MOUTH])
-    
+# OpenCV 4.10 이상은 디코딩 단계에서 바로 RGB로 출력 가능 (없으면 디코딩 후 변환)
+IMREAD_COLOR_RGB = getattr(cv2, "IMREAD_COLOR_RGB", None)
+
+# 비대칭 수치 계산은 numba로 JIT 컴파일 (없으면 순수 Python으로 실행)
+try:
+    from numba import njit
+    USE_NUMBA = True
+except ImportError:
+    USE_NUMBA = False
+    print("ℹ️ numba 없음 - Python 비대칭 계산 사용")
+
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+# MediaPipe 추론 입력 폭 (랜드마크는 정규화 좌표이므로 원본 크기로 그대로 환산)
+# FaceMesh는 내부적으로 192x192 입력을 쓰므로 기본 320이면 정확도 손실 없이 충분,
+# 멀리 앉는 환경처럼 얼굴이 작게 잡히면 환경 변수로 키울 수 있음
+INFERENCE_WIDTH = int(os.environ.get("INFERENCE_WIDTH", 320))
+
+# WebSocket 메시지 최대 크기 (640x480 JPEG 프레임은 수십 KB)
+WS_MAX_SIZE = 4 * 1024 * 1024
+
+# 클라이언트 프레임 전송 주기/화질 자동 조정 (N 프레임마다 평균 처리 시간 기준)
+TUNE_EVERY_FRAMES = 10
+TUNE_HEADROOM = 1.2
+MIN_FRAME_INTERVAL_MS = 100
+SLOW_FRAME_INTERVAL_MS = 200
+FRAME_QUALITY_HIGH = 0.6
+FRAME_QUALITY_LOW = 0.4
+
+# 연결당 최대 처리 속도 (조정 주기를 무시하고 빠르게 보내는 클라이언트도 이 이상은 처리하지 않음)
+MAX_PROCESS_FPS = 15
+
+# 마지막으로 분석한 얼굴 영역 (주요 랜드마크 범위 + 얼굴 폭 비율 여백)의 32x32 흑백 축소본과
+# 평균 화소 차이가 이보다 작으면 추론 생략
+THUMBNAIL_SIZE = 32
+FACE_BOX_MARGIN = 0.25
+DUPLICATE_FRAME_THRESHOLD = 1.0
+
+# 마지막으로 보낸 결과와 주요 랜드마크가 이 픽셀 이하로만 움직였으면 전송 생략
+LANDMARK_EPSILON_PX = 1
+
+# 전송 시점에 이미 쌓여 있는 결과를 한 메시지로 묶을 최대 개수 (기다려서 모으지는 않음)
+RESULT_BATCH_SIZE = 3
+
+# 프레임 처리 오류 로그 토큰 버킷 (초당 충전 개수, 최대 연속 기록 개수)
+FRAME_ERROR_LOG_RATE = 1.0
+FRAME_ERROR_LOG_BURST = 5
+
+# MediaPipe 주요 랜드마크 인덱스 (좌우반전된 화면 기준: 왼눈, 오른눈, 코끝, 턱, 왼입꼬리, 오른입꼬리)
+# 모델은 입력 영상의 화소만 보므로 반전된 프레임에서도 33/61은 영상 왼쪽, 263/291은 오른쪽에 놓임
+LEFT_EYE_OUTER = 33
+RIGHT_EYE_OUTER = 263
+NOSE_TIP = 1
+CHIN = 18
+LEFT_MOUTH = 61
+RIGHT_MOUTH = 291
+KEY_LANDMARK_INDICES = (LEFT_EYE_OUTER, RIGHT_EYE_OUTER, NOSE_TIP, CHIN, LEFT_MOUTH, RIGHT_MOUTH)
+
+@njit(cache=True, nogil=True, fastmath=True)
+def _asymmetry_metrics(coords, image_width):
+    """주요 랜드마크 픽셀 좌표 (6, 2) int16 배열로부터 비대칭 수치 계산"""
     # 비대칭 계산
-    eye_diff = left_eye[1] - right_eye[1]
-    mouth_diff = left_mouth[1] - right_mouth[1]
+    eye_diff = coords[0, 1] - coords[1, 1]
+    mouth_diff = coords[4, 1] - coords[5, 1]
     
     # 얼굴 중심 계산
-    face_center_x = (left_eye[0] + right_eye[0]) / 2
-    nose_center_offset = nose_tip[0] - face_center_x
+    face_center_x = (coords[0, 0] + coords[1, 0]) / 2
+    nose_center_offset = coords[2, 0] - face_center_x
     
     # 얼굴 크기 및 위치 계산
-    face_width = abs(right_eye[0] - left_eye[0])
-    screen_center_x = image_width / 2
-    face_center_y = (left_eye[1] + right_eye[1]) / 2
-    
-    position_offset_x = abs(face_center_x - screen_center_x)
-    
-    # 거리 피드백
-    if face_width < 120:
-        distance_feedback = "얼굴을 카메라에 더 가까이 가져오세요"
-    elif face_width > 200:
-        distance_feedback = "얼굴을 카메라에서 조금 멀리 하세요"
-    else:
-        distance_feedback = "적정 거리입니다"
+    face_width = abs(coords[1, 0] - coords[0, 0])
+    position_offset_x = abs(face_center_x - image_width / 2)
     
     # 캡처 준비 상태
     center_alignment_score = abs(nose_center_offset)
     face_stability = abs(eye_diff) + abs(mouth_diff)
     
-    capture_ready = bool(
-        120 <= face_width <= 200 and
-        center_alignment_score < 15 and
-        position_offset_x < 60 and
-        face_stability < 25
+    capture_ready = (
+        (120 <= face_width) & (face_width <= 200) &
+        (center_alignment_score < 15) &
+        (position_offset_x < 60) &
+        (face_stability < 25)
     )
     
-    # 비대칭 값 계산
-    eye_asymmetry_val = abs(eye_diff)
-    mouth_asymmetry_val = abs(mouth_diff)
-    nose_asymmetry_val = abs(nose_center_offset)
+    total_asym_value = abs(eye_diff) + abs(mouth_diff) + center_alignment_score
+    total_score = min(100.0, total_asym_value * 3)
     
-    total_asym_value = eye_asymmetry_val + mouth_asymmetry_val + nose_asymmetry_val
-    total_score = min(100, total_asym_value * 3)
+    return (eye_diff, mouth_diff, nose_center_offset, face_center_x, face_width,
+            center_alignment_score, face_stability, capture_ready, total_score)
+
+def run_face_mesh(rgb_frame):
+    """풀에서 FaceMesh 인스턴스를 빌려 랜드마크 추론 (작업 스레드에서 실행)"""
+    face_mesh = face_mesh_pool.get()
+    try:
+        return face_mesh.process(rgb_frame)
+    finally:
+        face_mesh_pool.put(face_mesh)
+
+def gather_key_landmarks(landmarks):
+    """MediaPipe 랜드마크에서 주요 랜드마크의 정규화 좌표를 (6, 2) 배열로 한 번에 추출"""
+    if not landmarks or len(landmarks) < 468:
+        return None
+    
+    key_landmarks = [landmarks[index] for index in KEY_LANDMARK_INDICES]
+    return np.fromiter(
+        (value for landmark in key_landmarks for value in (landmark.x, landmark.y)),
+        dtype=np.float64,
+        count=2 * len(KEY_LANDMARK_INDICES)
+    ).reshape(-1, 2)
+
+def analyze_face_asymmetry_mediapipe(points, image_width, image_height):
+    """주요 랜드마크 정규화 좌표 배열 (gather_key_landmarks 결과)을 사용한 비대칭 분석"""
+    if points is None:
+        return None
     
-    # 방향 계산 (영상 반전 고려)
-    eye_direction = "오른쪽 높음" if eye_diff < 0 else ("왼쪽 높음" if eye_diff > 0 else "대칭")
-    mouth_direction = "오른쪽 높음" if mouth_diff < 0 else ("왼쪽 높음" if mouth_diff > 0 else "대칭")
-    nose_direction = "왼쪽 치우침" if nose_center_offset > 0 else ("오른쪽 치우침" if nose_center_offset < 0 else "대칭")
+    # 픽셀 좌표로 변환 (소수점 버림, 화면 픽셀은 int16 범위)
+    coords = (points * np.array([image_width, image_height], dtype=np.float64)).astype(np.int16)
     
-    # 주요 랜드마크 좌표 (화면 표시용)
-    key_landmarks = [
-        left_eye, right_eye, nose_tip, chin, left_mouth, right_mouth
-    ]
+    (eye_diff, mouth_diff, nose_center_offset, face_center_x, face_width,
+     center_alignment_score, face_stability, capture_ready, total_score) = _asymmetry_metrics(coords, image_width)
+    
+    # 거리 피드백 코드 (DISTANCE_FEEDBACK_LABELS 인덱스)
+    if face_width < 120:
+        distance_feedback = 0
+    elif face_width > 200:
+        distance_feedback = 2
+    else:
+        distance_feedback = 1
     
+    # 문구는 연결 시 한 번만 보낸 라벨 표(LABELS_MESSAGE)의 인덱스로 전송
     return {
-        "eye_diff": round(float(-eye_diff), 1),
-        "mouth_diff": round(float(-mouth_diff), 1),
-        "nose_offset": round(float(-nose_center_offset), 1),
-        "eye_asymmetry_val": round(float(eye_asymmetry_val), 1),
-        "mouth_asymmetry_val": round(float(mouth_asymmetry_val), 1),
-        "nose_asymmetry_val": round(float(nose_asymmetry_val), 1),
-        "eye_direction": eye_direction,
-        "mouth_direction": mouth_direction,
-        "nose_direction": nose_direction,
+        "eye_diff": round(float(eye_diff), 1),
+        "mouth_diff": round(float(mouth_diff), 1),
+        "nose_offset": round(float(nose_center_offset), 1),
+        "eye_asymmetry_val": round(float(abs(eye_diff)), 1),
+        "mouth_asymmetry_val": round(float(abs(mouth_diff)), 1),
+        "nose_asymmetry_val": round(float(center_alignment_score), 1),
+        "eye_direction": direction_code(eye_diff),
+        "mouth_direction": direction_code(mouth_diff),
+        "nose_direction": direction_code(nose_center_offset),
         "total_score": round(float(total_score), 1),
         "assessment": get_asymmetry_assessment(total_score),
-        "landmarks_coords": key_landmarks,
-        "capture_ready": capture_ready,
+        # 주요 랜드마크 좌표 (화면 표시용, 전송 시 pack_message가 리스트로 변환)
+        "landmarks_coords": coords,
+        "capture_ready": bool(capture_ready),
         "center_alignment_score": round(float(center_alignment_score), 1),
         "distance_feedback": distance_feedback,
         "face_width": float(face_width),
@@ -130,56 +215,244 @@ def analyze_face_asymmetry_mediapipe(landmarks, image_width, image_height):
         "accurate_center_x": float(face_center_x)
     }
 
+# 비대칭 점수 구간별 평가 (점수가 경계값 미만이면 해당 구간)
+ASSESSMENT_THRESHOLDS = (5, 10, 20, 30)
+ASSESSMENT_LABELS = (
+    "매우 우수 (Very Symmetrical)",
+    "우수 (Good Symmetry)",
+    "보통 (Slight Asymmetry)",
+    "주의 (Moderate Asymmetry)",
+    "개선 필요 (Significant Asymmetry)"
+)
+
 def get_asymmetry_assessment(score):
-    if score < 5:
-        return "매우 우수 (Very Symmetrical)"
-    elif score < 10:
-        return "우수 (Good Symmetry)"
-    elif score < 20:
-        return "보통 (Slight Asymmetry)"
-    elif score < 30:
-        return "주의 (Moderate Asymmetry)"
+    """비대칭 점수의 평가 코드 (ASSESSMENT_LABELS 인덱스)"""
+    return bisect_right(ASSESSMENT_THRESHOLDS, score)
+
+# 화면 기준 좌우 방향 라벨 (direction_code 인덱스: 왼쪽, 대칭, 오른쪽)
+DIRECTION_LABELS = ("왼쪽 높음", "대칭", "오른쪽 높음")
+NOSE_DIRECTION_LABELS = ("왼쪽 치우침", "대칭", "오른쪽 치우침")
+DISTANCE_FEEDBACK_LABELS = (
+    "얼굴을 카메라에 더 가까이 가져오세요",
+    "적정 거리입니다",
+    "얼굴을 카메라에서 조금 멀리 하세요"
+)
+
+def direction_code(diff):
+    """좌우 차이의 부호를 방향 라벨 인덱스로 변환 (음수 0, 0은 1, 양수 2)"""
+    return 2 if diff > 0 else (0 if diff < 0 else 1)
+
+def _pack_default(obj):
+    # msgpack이 모르는 NumPy 배열 (랜드마크 좌표)만 리스트로 변환
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"직렬화할 수 없는 타입: {type(obj)!r}")
+
+def pack_message(message):
+    """클라이언트로 보낼 메시지를 msgpack 바이트로 직렬화"""
+    return msgpack.packb(message, default=_pack_default)
+
+# 결과 필드별 라벨 표 (연결 시 한 번 보내고, 프레임마다는 인덱스만 전송)
+LABELS_MESSAGE = pack_message({
+    "type": "labels",
+    "labels": {
+        "eye_direction": DIRECTION_LABELS,
+        "mouth_direction": DIRECTION_LABELS,
+        "nose_direction": NOSE_DIRECTION_LABELS,
+        "distance_feedback": DISTANCE_FEEDBACK_LABELS,
+        "assessment": ASSESSMENT_LABELS
+    }
+})
+
+# 고정 문구 오류 메시지 (얼굴이 화면 밖이면 매 프레임 나가므로 미리 직렬화)
+ERROR_MEDIAPIPE_UNAVAILABLE = pack_message({"error": "MediaPipe 로드 실패"})
+ERROR_NO_FACE = pack_message({"error": "얼굴을 찾을 수 없습니다"})
+ERROR_ANALYSIS_FAILED = pack_message({"error": "얼굴 분석 실패"})
+ERROR_NO_CAPTURE_DATA = pack_message({"error": "캡처할 얼굴 데이터가 없습니다."})
+
+def encode_jpeg(img, quality=75):
+    """RGB 이미지를 JPEG 바이트로 인코딩"""
+    if USE_SIMPLEJPEG:
+        # simplejpeg 기본값(4:4:4)보다 OpenCV와 같은 4:2:0 크로마 샘플링이 더 빠르고 작음
+        return simplejpeg.encode_jpeg(
+            np.ascontiguousarray(img), quality=quality, colorspace='RGB', colorsubsampling='420'
+        )
+    # OpenCV는 BGR만 받으므로 캡처 시점에만 변환
+    _, buffer = cv2.imencode('.jpg', cv2.cvtColor(img, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+def decode_jpeg(data):
+    """JPEG 바이트를 MediaPipe 입력과 같은 RGB 이미지로 디코딩"""
+    if USE_SIMPLEJPEG:
+        return simplejpeg.decode_jpeg(data, colorspace='RGB')
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if IMREAD_COLOR_RGB is not None:
+        frame = cv2.imdecode(buffer, IMREAD_COLOR_RGB)
+    else:
+        frame = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        if frame is not None:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    if frame is None:
+        raise ValueError("JPEG 디코딩 실패")
+    return frame
+
+def get_buffer(buffers, name, shape):
+    """연결별 작업 버퍼를 꺼내고, 없거나 크기가 바뀌었을 때만 새로 할당"""
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != shape:
+        buffer = buffers[name] = np.empty(shape, dtype=np.uint8)
+    return buffer
+
+def process_frame(image_data, buffers):
+    """JPEG 프레임 하나를 디코딩부터 msgpack 직렬화까지 처리 (작업 스레드에서 실행)
+
+    buffers는 연결별 작업 버퍼 dict로, 프레임마다 다시 할당하지 않고 재사용.
+    (frame, result, payload)를 반환. 분석에 실패하면 frame/result는 None이고
+    payload는 오류 메시지 msgpack 바이트.
+    """
+    decoded = decode_jpeg(image_data)
+    # 화면과 같은 좌우반전 좌표계로 한 번만 뒤집음 (복사 없는 뷰)
+    frame = decoded[:, ::-1]
+    
+    if not USE_MEDIAPIPE:
+        return None, None, ERROR_MEDIAPIPE_UNAVAILABLE
+    
+    # 프레임이 이미 RGB이므로 색 변환 없이 작업 버퍼에 바로 받아 추론.
+    # 반전 뷰(음수 stride)를 OpenCV에 넘기면 전체 프레임이 임시로 복사되므로
+    # 원본 방향 그대로 축소한 뒤 작은 버퍼에서 좌우반전
+    height, width = frame.shape[:2]
+    if width > INFERENCE_WIDTH:
+        shape = (round(height * INFERENCE_WIDTH / width), INFERENCE_WIDTH, 3)
+        small = get_buffer(buffers, "small", shape)
+        cv2.resize(decoded, (shape[1], shape[0]), dst=small, interpolation=cv2.INTER_AREA)
     else:
-        return "개선 필요 (Significant Asymmetry)"
+        small = decoded
+    rgb_frame = get_buffer(buffers, "rgb", small.shape)
+    cv2.flip(small, 1, dst=rgb_frame)
+    
+    # 마지막으로 분석한 얼굴 영역이 거의 그대로면 (정지 자세) 추론을 건너뛰고 그 결과를 재사용
+    face_box = buffers.get("face_box")
+    if face_box is not None:
+        thumbnail = face_thumbnail(rgb_frame, face_box)
+        if np.abs(thumbnail - buffers["thumbnail"]).mean() < DUPLICATE_FRAME_THRESHOLD:
+            result, payload = buffers["analysis"]
+            return frame, result, payload
+    
+    result, payload = analyze_frame(rgb_frame, width, height)
+    if result is None:
+        buffers["face_box"] = None
+        return None, None, payload
+    
+    face_box = buffers["face_box"] = get_face_box(result["landmarks_coords"], rgb_frame, width)
+    buffers["thumbnail"] = face_thumbnail(rgb_frame, face_box)
+    buffers["analysis"] = (result, payload)
+    # 디코딩 버퍼는 프레임마다 새로 만들어지고 이후 수정되지 않으므로 복사 없이 뷰를 그대로 넘김
+    return frame, result, payload
+
+def get_face_box(coords, rgb_frame, image_width):
+    """원본 픽셀 기준 주요 랜드마크 좌표로 추론 프레임 안의 얼굴 영역 (y0, y1, x0, x1) 계산"""
+    scale = rgb_frame.shape[1] / image_width
+    x0, y0 = coords.min(axis=0) * scale
+    x1, y1 = coords.max(axis=0) * scale
+    margin = (x1 - x0) * FACE_BOX_MARGIN
+    height, width = rgb_frame.shape[:2]
+    return (
+        max(0, int(y0 - margin)), min(height, int(y1 + margin) + 1),
+        max(0, int(x0 - margin)), min(width, int(x1 + margin) + 1)
+    )
+
+def face_thumbnail(rgb_frame, face_box):
+    """얼굴 영역만 잘라 THUMBNAIL_SIZE 정사각 흑백 축소본으로 변환 (중복 프레임 비교용)"""
+    y0, y1, x0, x1 = face_box
+    return cv2.cvtColor(
+        cv2.resize(rgb_frame[y0:y1, x0:x1], (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA),
+        cv2.COLOR_RGB2GRAY
+    ).astype(np.int16)
+
+def analyze_frame(rgb_frame, image_width, image_height):
+    """FaceMesh 추론 후 비대칭 분석, (result, payload) 반환 (실패 시 result는 None)"""
+    results = run_face_mesh(rgb_frame)
+    
+    if not results.multi_face_landmarks:
+        return None, ERROR_NO_FACE
+    
+    points = gather_key_landmarks(results.multi_face_landmarks[0].landmark)
+    result = analyze_face_asymmetry_mediapipe(points, image_width, image_height)
+    if not result:
+        return None, ERROR_ANALYSIS_FAILED
+    
+    return result, pack_message(result)
+
+# 잘못된 프레임이 계속 들어와도 로그 출력이 처리 루프를 막지 않도록 전체 연결 공용으로 제한
+frame_error_log = {"tokens": float(FRAME_ERROR_LOG_BURST), "updated": time.monotonic(), "dropped": 0}
+
+def log_frame_error(error):
+    """프레임 처리 오류를 토큰이 남아 있을 때만 기록하고, 그 사이 생략한 개수를 함께 남김"""
+    now = time.monotonic()
+    bucket = frame_error_log
+    bucket["tokens"] = min(FRAME_ERROR_LOG_BURST, bucket["tokens"] + (now - bucket["updated"]) * FRAME_ERROR_LOG_RATE)
+    bucket["updated"] = now
+    if bucket["tokens"] < 1:
+        bucket["dropped"] += 1
+        return
+    bucket["tokens"] -= 1
+    logger.error("프레임 처리 오류 (이전 %d건 생략): %s", bucket["dropped"], error, exc_info=error)
+    bucket["dropped"] = 0
+
+def warm_up_models():
+    """풀의 FaceMesh 그래프와 numba 비대칭 커널을 빈 입력으로 한 번씩 실행 (첫 프레임 지연 제거)"""
+    if USE_MEDIAPIPE:
+        dummy = np.zeros((INFERENCE_WIDTH * 3 // 4, INFERENCE_WIDTH, 3), dtype=np.uint8)
+        # 모든 인스턴스를 동시에 빌려야 같은 인스턴스만 반복해서 데우지 않음
+        face_meshes = [face_mesh_pool.get() for _ in range(FACE_MESH_POOL_SIZE)]
+        try:
+            for face_mesh in face_meshes:
+                face_mesh.process(dummy)
+        finally:
+            for face_mesh in face_meshes:
+                face_mesh_pool.put(face_mesh)
+    # numba가 없으면 커널은 일반 Python 함수라 미리 컴파일할 것이 없음
+    if USE_NUMBA:
+        analyze_face_asymmetry_mediapipe(np.zeros((len(KEY_LANDMARK_INDICES), 2)), INFERENCE_WIDTH, INFERENCE_WIDTH)
+
+def landmarks_unchanged(previous, current):
+    """주요 랜드마크 좌표가 LANDMARK_EPSILON_PX 이내로만 움직였는지 확인"""
+    if previous is None:
+        return False
+    return int(np.abs(current - previous).max()) <= LANDMARK_EPSILON_PX
 
 def create_symmetry_images_simple(frame, face_center_x):
-    """간단한 대칭 이미지 생성 (클라우드 최적화)"""
+    """간단한 대칭 이미지 생성 (클라우드 최적화, frame은 화면과 같은 좌우반전 영상)"""
     h, w, c = frame.shape
     center_x = int(face_center_x)
     
-    # 원본 이미지 (좌우반전 해제)
-    original = cv2.flip(frame, 1)
+    # 중심선 기준 반사 가능한 열 수 (중심 열 자체는 그대로 둠)
+    band = max(0, min(100, center_x, w - 1 - center_x))
+    left_band = slice(center_x - band, center_x)
+    right_band = slice(center_x + 1, center_x + 1 + band)
     
-    # 왼쪽 대칭 이미지
-    left_symmetric = frame.copy()
-    for x in range(center_x, min(w, center_x + 100)):
-        mirror_x = 2 * center_x - x
-        if 0 <= mirror_x < center_x:
-            left_symmetric[:, x] = left_symmetric[:, mirror_x]
-    left_symmetric = cv2.flip(left_symmetric, 1)
+    # 작업 버퍼는 캡처 시점에 한 번만 연속 배열로 복사하고, 이후에는 중심선 주변 띠만 고쳐 씀
+    canvas = frame.copy()
+    original = encode_jpeg(canvas)
     
-    # 오른쪽 대칭 이미지
-    right_symmetric = frame.copy()
-    for x in range(max(0, center_x - 100), center_x):
-        mirror_x = 2 * center_x - x
-        if center_x <= mirror_x < w:
-            right_symmetric[:, x] = right_symmetric[:, mirror_x]
-    right_symmetric = cv2.flip(right_symmetric, 1)
+    # 왼쪽 대칭 이미지: 중심 왼쪽 띠를 오른쪽 띠의 반사로 채움
+    canvas[:, left_band] = canvas[:, right_band][:, ::-1]
+    left_symmetric = encode_jpeg(canvas)
     
-    # 이미지를 base64로 인코딩
-    def encode_image(img):
-        _, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 75])
-        return base64.b64encode(buffer).decode('utf-8')
+    # 오른쪽 대칭 이미지: 왼쪽 띠를 원본으로 되돌린 뒤 오른쪽 띠를 왼쪽 띠의 반사로 채움
+    canvas[:, left_band] = frame[:, left_band]
+    canvas[:, right_band] = canvas[:, left_band][:, ::-1]
+    right_symmetric = encode_jpeg(canvas)
     
+    # JPEG 바이트 (WebSocket 바이너리 프레임으로 전송)
     return {
-        "original_image": encode_image(original),
-        "left_symmetric_image": encode_image(left_symmetric),
-        "right_symmetric_image": encode_image(right_symmetric)
+        "original_image": original,
+        "left_symmetric_image": left_symmetric,
+        "right_symmetric_image": right_symmetric
     }
 
-@app.get("/", response_class=HTMLResponse)
-async def get_index():
-    return """
+# 메인 페이지 HTML (요청마다 인코딩하지 않도록 모듈 로드 시 한 번만 바이트로 변환)
+INDEX_HTML = """
     <!DOCTYPE html>
     <html lang="ko">
     <head>
@@ -187,6 +460,7 @@ async def get_index():
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
         <title>성형외과용 미세표정 분석 시스템 - Cloud Edition</title>
         <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
+        <script src="https://cdn.jsdelivr.net/npm/@msgpack/msgpack@2.8.0/dist.es5+umd/msgpack.min.js"></script>
         <style>
             body { 
                 background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
@@ -253,7 +527,6 @@ async def get_index():
                 width: 100%; 
                 height: 100%; 
                 pointer-events: none; 
-                transform: scaleX(-1);
             }
             .analysis-section { 
                 flex: 1; 
@@ -436,6 +709,13 @@ async def get_index():
             let ws = null;
             let isAnalyzing = false;
             let asymmetryChart;
+            const symmetryImageIds = ['originalImage', 'leftSymmetryImage', 'rightSymmetryImage'];
+            let pendingImageIds = [];
+            // 서버가 연결 시 보내는 결과 필드별 라벨 표 (프레임 결과에는 인덱스만 옴)
+            let labelTables = {};
+            // 서버가 처리 시간에 맞춰 알려주는 프레임 전송 주기(ms)와 JPEG 화질
+            let frameInterval = 200;
+            let frameQuality = 0.6;
 
             function initializeChart() {
                 let chartCtx = document.getElementById('asymmetryChart').getContext('2d');
@@ -503,6 +783,7 @@ async def get_index():
                     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
                     const wsUrl = `${protocol}//${window.location.host}/ws`;
                     ws = new WebSocket(wsUrl);
+                    ws.binaryType = 'arraybuffer';
                     
                     ws.onopen = function() {
                         document.getElementById('status').textContent = '✅ 클라우드 서버 연결 성공! 분석 시작...';
@@ -511,12 +792,27 @@ async def get_index():
                         document.getElementById('captureBtn').disabled = false;
                         document.getElementById('symmetrySection').style.display = 'block';
                         isAnalyzing = true;
+                        pendingImageIds = [];
+                        frameInterval = 200;
+                        frameQuality = 0.6;
                         sendFrames();
                     };
                     ws.onmessage = function(event) {
+                        // 캡처 헤더 뒤의 바이너리 메시지는 JPEG, 그 외에는 msgpack
+                        if (pendingImageIds.length > 0) {
+                            showSymmetryImage(event.data);
+                            return;
+                        }
                         try {
-                            const data = JSON.parse(event.data);
-                            updateResults(data);
+                            const data = MessagePack.decode(event.data);
+                            if (Array.isArray(data)) {
+                                data.forEach(handleMessage);
+                                return;
+                            }
+                            if (data.type === 'symmetry') {
+                                pendingImageIds = symmetryImageIds.slice(0, data.parts);
+                            }
+                            handleMessage(data);
                         } catch (e) {
                             console.error('메시지 파싱 오류:', e);
                         }
@@ -584,19 +880,33 @@ async def get_index():
                 
                 tempCanvas.toBlob(function(blob) {
                     if (blob && isAnalyzing && ws && ws.readyState === WebSocket.OPEN) {
-                        const reader = new FileReader();
-                        reader.onloadend = function() {
-                            try {
-                                ws.send(reader.result.split(',')[1]);
-                            } catch (e) {
-                                console.error('프레임 전송 오류:', e);
-                            }
-                        };
-                        reader.readAsDataURL(blob);
+                        try {
+                            ws.send(blob);
+                        } catch (e) {
+                            console.error('프레임 전송 오류:', e);
+                        }
                     }
-                }, 'image/jpeg', 0.6);
+                }, 'image/jpeg', frameQuality);
                 
-                setTimeout(sendFrames, 200);
+                setTimeout(sendFrames, frameInterval);
+            }
+
+            function handleMessage(data) {
+                if (data.type === 'labels') {
+                    labelTables = data.labels;
+                    return;
+                }
+                if (data.type === 'tune') {
+                    frameInterval = data.interval_ms;
+                    frameQuality = data.quality;
+                    return;
+                }
+                for (const key in labelTables) {
+                    if (key in data) {
+                        data[key] = labelTables[key][data[key]];
+                    }
+                }
+                updateResults(data);
             }
 
             function updateResults(data) {
@@ -625,12 +935,14 @@ async def get_index():
                 asymmetryChart.update();
                 
                 drawGuideLines(data.landmarks_coords);
-                
-                if (data.original_image) {
-                    document.getElementById('originalImage').src = `data:image/jpeg;base64,${data.original_image}`;
-                    document.getElementById('leftSymmetryImage').src = `data:image/jpeg;base64,${data.left_symmetric_image}`;
-                    document.getElementById('rightSymmetryImage').src = `data:image/jpeg;base64,${data.right_symmetric_image}`;
-                }
+            }
+
+            function showSymmetryImage(buffer) {
+                const imageId = pendingImageIds.shift();
+                if (!imageId) return;
+                const img = document.getElementById(imageId);
+                if (img.src.startsWith('blob:')) { URL.revokeObjectURL(img.src); }
+                img.src = URL.createObjectURL(new Blob([buffer], { type: 'image/jpeg' }));
             }
 
             function drawGuideLines(landmarks_coords) {
@@ -679,77 +991,169 @@ async def get_index():
     </body>
     </html>
     """
+INDEX_HTML_BYTES = INDEX_HTML.encode("utf-8")
+
+@app.get("/", response_class=HTMLResponse)
+async def get_index():
+    return Response(
+        content=INDEX_HTML_BYTES,
+        media_type="text/html",
+        headers={"Cache-Control": "public, max-age=3600"}
+    )
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    global captured_images, last_frame_data
     await websocket.accept()
     print("클라우드 클라이언트 연결됨")
+    await websocket.send_bytes(LABELS_MESSAGE)
     
-    try:
+    # 연결별 상태 (마지막 분석 프레임/결과, 프레임 처리용 작업 버퍼)
+    state = {
+        "frame": None, "landmarks": None, "buffers": {},
+        "sent_coords": None, "process_time": 0.0, "processed": 0, "last_started": 0.0
+    }
+    
+    # 처리 대기 프레임은 최신 1장만 유지 (처리가 밀리면 이전 프레임은 버림)
+    frame_queue = asyncio.Queue(maxsize=1)
+    # 프레임별 분석 결과는 msgpack 배열로 전송 (전송이 밀린 동안 쌓인 결과는 한 번에)
+    result_queue = asyncio.Queue()
+    send_lock = asyncio.Lock()
+    
+    async def receive_frames():
+        loop = asyncio.get_running_loop()
         while True:
-            message_type = await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
             
-            if message_type == "manual_capture_request":
-                if last_frame_data["frame"] is not None and last_frame_data["landmarks"] is not None:
+            # 텍스트 프레임은 제어 메시지, 바이너리 프레임은 JPEG 영상
+            if message.get("text") == "manual_capture_request":
+                if state["frame"] is not None and state["landmarks"] is not None:
                     print("클라우드 캡처 요청 수신")
-                    symmetry_images = create_symmetry_images_simple(
-                        last_frame_data["frame"], 
-                        last_frame_data["landmarks"]["accurate_center_x"]
+                    # 처리 중 다음 프레임으로 바뀌지 않도록 현재 프레임과 결과를 붙잡아 둠
+                    landmarks = state["landmarks"]
+                    # JPEG 3장 인코딩도 작업 스레드에서 실행해 이벤트 루프를 막지 않음
+                    captures = await loop.run_in_executor(
+                        frame_executor, create_symmetry_images_simple,
+                        state["frame"], landmarks["accurate_center_x"]
                     )
-                    captured_images.update(symmetry_images)
                     
-                    result_to_send = last_frame_data["landmarks"].copy()
-                    result_to_send.update(captured_images)
-                    await websocket.send_text(json.dumps(result_to_send, ensure_ascii=False))
+                    # msgpack 헤더 뒤에 이미지 3장을 바이너리 프레임으로 전송
+                    parts = [
+                        captures["original_image"],
+                        captures["left_symmetric_image"],
+                        captures["right_symmetric_image"]
+                    ]
+                    header = {
+                        **landmarks,
+                        "type": "symmetry",
+                        "parts": len(parts),
+                        "sizes": [len(p) for p in parts]
+                    }
+                    # 헤더와 이미지 사이에 다른 메시지가 끼어들지 않도록 묶어서 전송
+                    async with send_lock:
+                        await websocket.send_bytes(pack_message(header))
+                        for part in parts:
+                            await websocket.send_bytes(part)
                 else:
-                    await websocket.send_text(json.dumps({"error": "캡처할 얼굴 데이터가 없습니다."}, ensure_ascii=False))
+                    await websocket.send_bytes(ERROR_NO_CAPTURE_DATA)
+                continue
+            
+            image_data = message.get("bytes")
+            if not image_data:
                 continue
             
+            if frame_queue.full():
+                frame_queue.get_nowait()
+            frame_queue.put_nowait(image_data)
+    
+    async def process_frames():
+        loop = asyncio.get_running_loop()
+        while True:
+            image_data = await frame_queue.get()
+            # 처리 간격이 너무 짧으면 기다렸다가 그 사이 도착한 최신 프레임으로 교체
+            delay = state["last_started"] + 1 / MAX_PROCESS_FPS - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                if not frame_queue.empty():
+                    image_data = frame_queue.get_nowait()
+            started = state["last_started"] = time.perf_counter()
             try:
-                image_data = base64.b64decode(message_type)
-                image = Image.open(BytesIO(image_data))
-                frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                
-                if USE_MEDIAPIPE:
-                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    results = face_mesh.process(rgb_frame)
-                    
-                    if results.multi_face_landmarks:
-                        landmarks = results.multi_face_landmarks[0].landmark
-                        result = analyze_face_asymmetry_mediapipe(landmarks, frame.shape[1], frame.shape[0])
-                        
-                        if result:
-                            last_frame_data["frame"] = frame.copy()
-                            last_frame_data["landmarks"] = result
-                            
-                            if captured_images:
-                                result.update(captured_images)
-                            
-                            await websocket.send_text(json.dumps(result, ensure_ascii=False))
-                        else:
-                            await websocket.send_text(json.dumps({"error": "얼굴 분석 실패"}, ensure_ascii=False))
-                    else:
-                        await websocket.send_text(json.dumps({"error": "얼굴을 찾을 수 없습니다"}, ensure_ascii=False))
-                else:
-                    await websocket.send_text(json.dumps({"error": "MediaPipe 로드 실패"}, ensure_ascii=False))
-                    
+                frame, result, payload = await loop.run_in_executor(
+                    frame_executor, process_frame, image_data, state["buffers"]
+                )
+                if result is not None:
+                    state["frame"] = frame
+                    state["landmarks"] = result
             except Exception as e:
-                print(f"프레임 처리 오류: {e}")
-                await websocket.send_text(json.dumps({"error": f"처리 오류: {str(e)}"}, ensure_ascii=False))
-                
+                log_frame_error(e)
+                result = None
+                payload = pack_message({"error": f"처리 오류: {str(e)}"})
+            
+            # 정지한 얼굴은 결과가 거의 같으므로 의미 있게 움직였을 때만 전송
+            if result is None:
+                state["sent_coords"] = None
+                result_queue.put_nowait(payload)
+            elif not landmarks_unchanged(state["sent_coords"], result["landmarks_coords"]):
+                state["sent_coords"] = result["landmarks_coords"]
+                result_queue.put_nowait(payload)
+            
+            # 평균 처리 시간의 여유분만큼 전송 주기를 맞추고, 서버가 밀리면 화질도 낮춤
+            state["process_time"] += time.perf_counter() - started
+            state["processed"] += 1
+            if state["processed"] >= TUNE_EVERY_FRAMES:
+                average_ms = state["process_time"] / state["processed"] * 1000
+                interval_ms = max(MIN_FRAME_INTERVAL_MS, round(average_ms * TUNE_HEADROOM))
+                quality = FRAME_QUALITY_LOW if interval_ms > SLOW_FRAME_INTERVAL_MS else FRAME_QUALITY_HIGH
+                result_queue.put_nowait(pack_message({"type": "tune", "interval_ms": interval_ms, "quality": quality}))
+                state["process_time"] = 0.0
+                state["processed"] = 0
+    
+    async def send_results():
+        while True:
+            # 결과는 바로 보내고, 직전 전송이 끝나기를 기다리는 동안 쌓인 것만 함께 묶음
+            batch = [await result_queue.get()]
+            while len(batch) < RESULT_BATCH_SIZE and not result_queue.empty():
+                batch.append(result_queue.get_nowait())
+            # 결과는 작업 스레드에서 이미 msgpack으로 직렬화되어 있으므로 배열 헤더 뒤에 이어 붙이기만 함
+            async with send_lock:
+                await websocket.send_bytes(msgpack.Packer().pack_array_header(len(batch)) + b"".join(batch))
+    
+    # 수신과 처리를 분리해 느린 프레임 처리가 수신 버퍼를 쌓지 않도록 함
+    tasks = [
+        asyncio.create_task(receive_frames()),
+        asyncio.create_task(process_frames()),
+        asyncio.create_task(send_results())
+    ]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
     except Exception as e:
         print(f"WebSocket 오류: {e}")
     finally:
+        for task in tasks:
+            task.cancel()
         print("클라우드 클라이언트 연결 해제됨")
-        captured_images.clear()
-        last_frame_data["frame"] = None
-        last_frame_data["landmarks"] = None
+
+# 헬스 체크 응답은 항상 같으므로 모듈 로드 시 한 번만 직렬화
+HEALTH_RESPONSE_BYTES = json.dumps(
+    {"status": "healthy", "message": "성형외과용 미세표정 분석 시스템이 정상 작동 중입니다."},
+    ensure_ascii=False, separators=(",", ":")
+).encode("utf-8")
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "message": "성형외과용 미세표정 분석 시스템이 정상 작동 중입니다."}
+    return Response(content=HEALTH_RESPONSE_BYTES, media_type="application/json")
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # uvloop은 uvicorn[standard]로 설치되면 "auto"에서 선택됨 (Windows에서는 asyncio로 대체)
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=port,
+        loop="auto",
+        ws="websockets",
+        ws_max_size=WS_MAX_SIZE
+    )